@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Gauge, Counter
+
+# =========================================================
+# 🚦 ADMISSION CONTROL
+# per-endpoint concurrency + bounded queue + request deadline
+#
+# override with BOOKAI_LIMIT_<NAME>=concurrency,queue,deadline_s
+# e.g. BOOKAI_LIMIT_ASK_BOOK_AI=1,2,30
+# =========================================================
+DEFAULT_LIMITS = {
+    "scan":        (4, 32, 15.0),
+    "scan-shelf":  (1, 4, 60.0),
+    "add":         (2, 8, 20.0),
+    "sync":        (4, 16, 15.0),
+    "ask-book-ai": (2, 4, 45.0),
+}
+
+# separate pools → slow remote calls can't occupy the embedding threads
+EMBED_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BOOKAI_EMBED_WORKERS", "2")),
+    thread_name_prefix="embed"
+)
+REMOTE_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BOOKAI_REMOTE_WORKERS", "8")),
+    thread_name_prefix="remote"
+)
+# catalog writes wait on shard / file locks → kept off the embedding threads
+WRITE_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BOOKAI_WRITE_WORKERS", "2")),
+    thread_name_prefix="write"
+)
+
+_deadline = contextvars.ContextVar("bookai_deadline", default=None)
+
+
+class Rejected(Exception):
+    """Request shed before any work started."""
+
+    def __init__(self, endpoint, reason, status):
+        super().__init__(f"{endpoint}: {reason}")
+        self.endpoint = endpoint
+        self.reason = reason
+        self.status = status
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed while work was still pending."""
+
+
+# ---------------- GATE ----------------
+class Gate:
+
+    def __init__(self, name, concurrency, queue, deadline):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.deadline = deadline
+        self.sem = asyncio.Semaphore(concurrency)
+        self.waiting = 0
+        self.inside = 0   # admitted + waiting, counted before any await
+
+
+def _limits(name):
+    raw = os.environ.get("BOOKAI_LIMIT_" + name.upper().replace("-", "_"))
+    if not raw:
+        return DEFAULT_LIMITS[name]
+
+    concurrency, queue, deadline = raw.split(",")
+    return int(concurrency), int(queue), float(deadline)
+
+
+GATES = {name: Gate(name, *_limits(name)) for name in DEFAULT_LIMITS}
+
+QUEUE_DEPTH = Gauge(
+    "bookai_queue_depth",
+    "Requests waiting for an admission slot",
+    labels=("endpoint",),
+    fn=lambda: {(g.name,): g.waiting for g in GATES.values()}
+)
+
+REJECTED = Counter(
+    "bookai_rejected_total",
+    "Requests shed by admission control",
+    labels=("endpoint", "reason")
+)
+
+
+# ---------------- DEADLINE ----------------
+def remaining():
+    """Seconds left for the current request, or None outside a request."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded()
+
+
+def remote_timeout(default):
+    """Timeout for an outgoing call: never longer than the request has left."""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(default, left)
+
+
+# ---------------- ADMIT ----------------
+@asynccontextmanager
+async def admit(name):
+    gate = GATES[name]
+
+    # fast reject → no point queueing behind a full line.
+    # counted synchronously: a burst arriving in one loop tick never
+    # gets as far as sem.acquire(), so sem.locked() can't see it
+    if gate.inside >= gate.concurrency + gate.queue:
+        REJECTED.inc(name, "queue_full")
+        raise Rejected(name, "queue_full", 429)
+
+    gate.inside += 1
+    token = _deadline.set(time.monotonic() + gate.deadline)
+
+    try:
+        gate.waiting += 1
+        try:
+            await asyncio.wait_for(gate.sem.acquire(), remaining())
+        except asyncio.TimeoutError:
+            REJECTED.inc(name, "queue_timeout")
+            raise Rejected(name, "queue_timeout", 503)
+        finally:
+            gate.waiting -= 1
+
+        try:
+            yield
+        finally:
+            gate.sem.release()
+
+    finally:
+        gate.inside -= 1
+        _deadline.reset(token)
+
+
+# ---------------- RUN IN POOL ----------------
+async def run(pool, fn, *args):
+    """
+    Run fn in pool with the request's context (so the deadline follows it).
+    Gives up at the deadline; the thread stops at its next check_deadline().
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    future = loop.run_in_executor(pool, ctx.run, fn, *args)
+
+    left = remaining()
+    if left is None:
+        return await future
+
+    try:
+        return await asyncio.wait_for(future, max(left, 0))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
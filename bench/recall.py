@@ -0,0 +1,185 @@
+"""
+Recall of the compact index modes against the exact flat index.
+
+    python -m bench.recall --shard global
+    python -m bench.recall --synthetic 100000 --modes flat fp16 pq
+
+Queries are stored covers with noise added, like a cover photographed
+again. Noise is swept so exact scores land on both sides of
+MATCH_THRESHOLD (a unit row plus noise of norm n scores about
+1/sqrt(1 + n^2), i.e. 0.72 near n = 0.96). For each noise level and mode
+it reports how often the match decision (and the matched book) is the
+same as the flat index.
+The exact baseline holds every row in RAM, so run this offline.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def noisy_queries(rows, ids, noise, seed=7):
+    rng = np.random.default_rng(seed)
+    q = rows[ids] + rng.standard_normal((len(ids), rows.shape[1])).astype("float32") * (noise / np.sqrt(rows.shape[1]))
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def exact_top1(rows, queries):
+    exact = []
+    for i in range(0, len(queries), 64):
+        scores = queries[i:i + 64] @ rows.T
+        best = scores.argmax(axis=1)
+        exact.extend((int(b), float(scores[n, b])) for n, b in enumerate(best))
+    return exact
+
+
+def build(shard, mode):
+    import faiss
+    from image_search import make_index
+
+    total = len(shard.books)
+
+    start = time.perf_counter()
+    shard.index = make_index(total, shard.iter_rows, mode)
+    for chunk in shard.iter_rows():
+        shard.index.add(chunk)
+    elapsed = time.perf_counter() - start
+
+    size = faiss.serialize_index(shard.index).nbytes
+    return {
+        "index_type": type(shard.index).__name__,
+        "index_bytes": int(size),
+        "bytes_per_book": round(size / max(total, 1), 1),
+        "build_s": round(elapsed, 3),
+    }
+
+
+# shard.index must already be built for the mode under test
+def evaluate(shard, queries, exact, threshold):
+    from image_search import RERANK_CANDIDATES
+
+    top1 = shortlist = agree = false_reject = false_accept = 0
+    errors, latency = [], []
+
+    for q, (e_id, e_score) in zip(queries, exact):
+        q = q.reshape(1, -1)
+
+        start = time.perf_counter()
+        hit = shard.topk(q, 1)
+        latency.append(time.perf_counter() - start)
+
+        c_id, c_score = hit[0] if hit else (-1, 0.0)
+
+        # is the exact answer inside the first-pass candidate list?
+        _, I = shard.index.search(q, max(1, RERANK_CANDIDATES))
+        shortlist += int(e_id in set(int(i) for i in I[0]))
+
+        top1 += int(c_id == e_id)
+        errors.append(abs(c_score - e_score))
+
+        e_match = e_score >= threshold
+        c_match = c_score >= threshold
+
+        if e_match and not c_match:
+            false_reject += 1
+        elif c_match and not e_match:
+            false_accept += 1
+        elif e_match == c_match and (not e_match or c_id == e_id):
+            agree += 1
+
+    n = len(queries)
+    return {
+        "top1_recall": round(top1 / n, 4),
+        "shortlist_recall": round(shortlist / n, 4),
+        "match_agreement": round(agree / n, 4),
+        "false_reject": round(false_reject / n, 4),
+        "false_accept": round(false_accept / n, 4),
+        "mean_abs_score_error": round(float(np.mean(errors)), 5),
+        "p50_search_ms": round(float(np.percentile(latency, 50)) * 1000, 3),
+        "p99_search_ms": round(float(np.percentile(latency, 99)) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact index recall vs flat")
+    parser.add_argument("--shard", default="global", help="shard to evaluate (under BOOK_DATA_DIR)")
+    parser.add_argument("--synthetic", type=int, help="use N random vectors instead of a shard")
+    parser.add_argument("--modes", nargs="*", default=["flat", "fp16", "pq"])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--noise", type=float, nargs="*", default=[0.6, 0.8, 0.9, 0.95, 1.0, 1.05, 1.1, 1.3],
+                        help="noise norms added to each query, one run per level")
+    parser.add_argument("--out", help="write JSON here (default: stdout)")
+    args = parser.parse_args()
+
+    import image_search
+
+    shard = image_search.Shard(args.shard, image_search.read_space(args.shard)["active"])
+
+    if args.synthetic:
+        from bench.run import random_vectors
+        shard.books = [{"title": f"Book_{i}"} for i in range(args.synthetic)]
+        shard.pending = list(random_vectors(args.synthetic, image_search.DIM))
+    else:
+        shard.load_db()
+
+    total = len(shard.books)
+    if total == 0:
+        print("⚠️ Shard is empty", file=sys.stderr)
+        return
+
+    threshold = image_search.MATCH_THRESHOLD
+    rows = np.vstack(list(shard.iter_rows()))
+    rng = np.random.default_rng(0)
+    ids = rng.choice(total, size=min(args.queries, total), replace=False)
+
+    # exact baseline per noise level: brute force over full-precision rows
+    levels = []
+    for noise in args.noise:
+        queries = noisy_queries(rows, ids, noise)
+        exact = exact_top1(rows, queries)
+        scores = np.array([s for _, s in exact])
+        levels.append((noise, queries, exact, {
+            "noise": noise,
+            "exact_match_rate": round(float(np.mean(scores >= threshold)), 4),
+            "exact_score_p10": round(float(np.percentile(scores, 10)), 4),
+            "exact_score_p50": round(float(np.percentile(scores, 50)), 4),
+            "exact_score_p90": round(float(np.percentile(scores, 90)), 4),
+            "modes": {},
+        }))
+
+    report = {
+        "shard": "synthetic" if args.synthetic else args.shard,
+        "books": total,
+        "queries": len(ids),
+        "match_threshold": threshold,
+        "rerank_candidates": image_search.RERANK_CANDIDATES,
+        "indexes": {},
+        "noise_levels": [level for *_, level in levels],
+    }
+
+    # one build per mode, evaluated at every noise level
+    for mode in args.modes:
+        print(f"⏱ {mode}...", file=sys.stderr)
+        report["indexes"][mode] = build(shard, mode)
+
+        for noise, queries, exact, level in levels:
+            level["modes"][mode] = evaluate(shard, queries, exact, threshold)
+
+    text = json.dumps(report, indent=2)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+End-to-end benchmark for the scan / add / ask-book-ai hot paths.
+
+    python -m bench.run --out bench_output.json
+    python -m bench.run --sizes 1000 10000 --random-weights
+
+Times every stage on its own and then drives the real endpoints under
+concurrent load. Firebase and Groq are replaced by bench.stubs, and the
+catalog lives in a temp dir, so runs are repeatable offline (apart from the
+pretrained weight download unless --random-weights is given).
+Results are a single JSON document so commits can be diffed.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import stubs  # noqa: E402
+
+
+# ---------------- STATS ----------------
+def summarize(samples):
+    ms = np.array(samples, dtype="float64") * 1000
+    return {
+        "n": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "min_ms": round(float(ms.min()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def timeit(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+# ---------------- FIXTURES ----------------
+def make_images(folder, count, size=(600, 900), seed=0, prefix="cover"):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        # coloured blocks + noise → distinct embeddings per "cover"
+        arr = rng.integers(0, 255, (8, 6, 3), dtype=np.uint8)
+        img = Image.fromarray(arr).resize(size, Image.NEAREST)
+        noise = rng.integers(-20, 20, (size[1], size[0], 3))
+        img = Image.fromarray(np.clip(np.array(img) + noise, 0, 255).astype("uint8"))
+
+        path = os.path.join(folder, f"{prefix}_{i}.jpg")
+        img.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def random_vectors(n, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    v = rng.standard_normal((n, dim)).astype("float32")
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+# =========================================================
+# ⏱ STAGES
+# =========================================================
+def bench_stages(image_path, repeat):
+    import main
+    import image_embedder
+
+    img = Image.open(image_path).convert("RGB")
+    img = image_embedder.remove_lighting(img)
+    w, h = img.size
+    crop = img.crop((w * 0.12, h * 0.12, w * 0.88, h * 0.88))
+
+    def decode_and_light():
+        with Image.open(image_path) as raw:
+            image_embedder.remove_lighting(raw.convert("RGB"))
+
+    return {
+        "validate_image": timeit(lambda: main.validate_image(image_path), repeat),
+        "decode_remove_lighting": timeit(decode_and_light, repeat),
+        "transform": timeit(lambda: image_embedder.get_transform()(img), repeat),
+        "extract_full": timeit(lambda: image_embedder.extract(img), repeat),
+        "extract_crop": timeit(lambda: image_embedder.extract(crop), repeat),
+        "get_image_embedding": timeit(lambda: image_embedder.get_image_embedding(image_path), repeat),
+    }
+
+
+# =========================================================
+# 📚 CATALOG SIZE
+# =========================================================
+def bench_catalog(sizes, repeat):
+    import faiss
+    import image_search
+
+    query = random_vectors(1, image_search.DIM, seed=1)
+    results = {}
+
+    for n in sizes:
+        print(f"⏱ catalog size {n}...", file=sys.stderr)
+
+        shard = image_search.Shard(f"bench-{n}")
+        os.makedirs(shard.dir, exist_ok=True)
+
+        shard.books = [{"title": f"Book_{i}"} for i in range(n)]
+        shard.pending = list(random_vectors(n, image_search.DIM))
+        shard.loaded = True
+
+        # save/rebuild are slow at 100k → fewer rounds
+        heavy = max(1, min(repeat, 3))
+
+        results[str(n)] = {
+            "save_db": timeit(shard.save_db, heavy, warmup=0),
+            "rebuild_index": timeit(shard.rebuild_index, heavy, warmup=0),
+            "faiss_search": timeit(lambda: shard.index.search(query, 1), repeat * 10),
+            "shard_search": timeit(lambda: shard.search(query, 1), repeat * 10),
+            "books_json_bytes": os.path.getsize(shard.data_file),
+            "index_mode": image_search.INDEX_MODE,
+            "index_bytes": int(faiss.serialize_index(shard.index).nbytes),
+        }
+
+        shard.books = []
+        shard.pending = []
+        shard.index = None
+
+    return results
+
+
+# =========================================================
+# 🌐 ENDPOINTS UNDER LOAD
+# =========================================================
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server():
+    import uvicorn
+    import main
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+
+    while not server.started:
+        time.sleep(0.05)
+
+    return server, f"http://127.0.0.1:{port}"
+
+
+def drive(url, images, total, concurrency, auth=True):
+    import requests
+
+    def _one(i):
+        path = images[i % len(images)]
+        headers = {"Authorization": f"Bearer user{i % concurrency}"} if auth else {}
+
+        with open(path, "rb") as f:
+            start = time.perf_counter()
+            res = requests.post(url, headers=headers, files={"file": ("cover.jpg", f, "image/jpeg")})
+            elapsed = time.perf_counter() - start
+
+        try:
+            status = res.json().get("status")
+        except ValueError:
+            status = None
+
+        return elapsed, res.status_code, status
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(_one, range(total)))
+    wall = time.perf_counter() - wall
+
+    codes, statuses = {}, {}
+    for _, code, status in results:
+        codes[str(code)] = codes.get(str(code), 0) + 1
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    # fast 429s would otherwise drag the percentiles down
+    ok = [elapsed for elapsed, code, _ in results if 200 <= code < 300]
+    shed = [elapsed for elapsed, code, _ in results if code == 429]
+
+    out = {
+        "all": summarize([r[0] for r in results]),
+        "ok": summarize(ok) if ok else None,
+        "rejected_429": summarize(shed) if shed else None,
+    }
+    out["throughput_rps"] = round(total / wall, 2)
+    out["ok_rps"] = round(len(ok) / wall, 2)
+    out["status_codes"] = codes
+    out["statuses"] = statuses
+    return out
+
+
+# fresh → covers not in the catalog, one per /add request, so every add
+# takes the new-book path (log append + fsync, compaction, index_add)
+def bench_endpoints(images, fresh, total, concurrency):
+    import image_search
+
+    # seed the catalog so /scan has something to hit
+    for i, path in enumerate(images):
+        image_search.add_book(path, f"Seed_{i}")
+
+    server, base = start_server()
+
+    try:
+        return {
+            "scan": drive(base + "/scan", images, total, concurrency),
+            "add": drive(base + "/add", fresh, total, concurrency),
+            "ask_book_ai": drive(base + "/ask-book-ai", images, total, concurrency, auth=False),
+        }
+    finally:
+        server.should_exit = True
+
+
+# ---------------- META ----------------
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scan/add/ask-book-ai hot paths")
+    parser.add_argument("--out", help="write JSON here (default: stdout)")
+    parser.add_argument("--repeat", type=int, default=10, help="rounds per stage")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 10000, 100000])
+    parser.add_argument("--requests", type=int, default=64, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--images", type=int, default=8, help="distinct synthetic covers")
+    parser.add_argument("--random-weights", action="store_true", help="skip pretrained download")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    args = parser.parse_args()
+
+    out = os.path.abspath(args.out) if args.out else None
+    workdir = tempfile.mkdtemp(prefix="bookbench_")
+
+    # before importing anything that reads these at import time
+    os.environ["BOOK_DATA_DIR"] = os.path.join(workdir, "data")
+    stubs.install()
+    os.chdir(workdir)
+
+    import torch
+    import image_embedder
+
+    if args.random_weights:
+        import timm
+        backbone = image_embedder.EMBEDDERS[image_embedder.EMBEDDER_VERSION]["backbone"]
+        image_embedder._models[backbone] = timm.create_model(backbone, pretrained=False, num_classes=0).eval()
+
+    load = time.perf_counter()
+    image_embedder.get_model()
+    model_load_s = time.perf_counter() - load
+
+    images = make_images(workdir, args.images)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "embedder_version": image_embedder.EMBEDDER_VERSION,
+            "args": vars(args),
+        },
+        "model_load_ms": round(model_load_s * 1000, 3),
+        "stages": bench_stages(images[0], args.repeat),
+        "catalog": bench_catalog(args.sizes, args.repeat),
+    }
+
+    if not args.skip_endpoints:
+        fresh = make_images(workdir, args.requests, seed=1, prefix="new")
+        report["endpoints"] = bench_endpoints(images, fresh, args.requests, args.concurrency)
+
+    text = json.dumps(report, indent=2)
+
+    if out:
+        with open(out, "w") as f:
+            f.write(text)
+        print(f"✅ Benchmark written to {out}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
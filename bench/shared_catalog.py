@@ -0,0 +1,164 @@
+"""
+Several processes writing to one catalog, plus a follower searching it.
+
+    python -m bench.shared_catalog
+    python -m bench.shared_catalog --writers 6 --books 300 --compact-every 20
+
+Every writer adds its own books to the global shard of a temp
+BOOK_DATA_DIR while a follower process keeps searching. A small
+BOOK_LOG_COMPACT_EVERY forces many compactions along the way. When all
+writers are done, every process (and a fresh load) must hold the same
+titles, with index.ntotal == len(books). Exits non-zero otherwise.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# unit vectors; only numpy, so the check runs without the bench stubs
+def vectors(n, dim, seed):
+    rng = np.random.default_rng(seed)
+    v = rng.standard_normal((n, dim)).astype("float32")
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def state(role, shard):
+    shard.sync()
+    titles = [b["title"] for b in shard.books]
+    return {
+        "role": role,
+        "titles": sorted(titles),
+        "books": len(titles),
+        "unique": len(set(titles)),
+        "ntotal": int(shard.index.ntotal),
+        "index": type(shard.index).__name__,
+        "generation": shard.generation,
+    }
+
+
+# ---------------- PROCESSES ----------------
+def writer(i, books, wrote, done, results):
+    import image_search
+
+    shard = image_search.get_space(image_search.GLOBAL_SHARD)
+
+    for j, v in enumerate(vectors(books, shard.dim, seed=i + 1)):
+        shard.add(v.reshape(1, -1), f"writer{i}_{j}", dedupe=False)
+
+    wrote.put(i)
+    done.wait()
+    results.put(state(f"writer{i}", shard))
+
+
+def follower(done, results):
+    import image_search
+
+    shard = image_search.get_space(image_search.GLOBAL_SHARD)
+    queries = vectors(16, shard.dim, seed=99)
+    searches = 0
+
+    # keep reading while the writers append and compact underneath
+    while not done.is_set():
+        shard.search(queries[searches % len(queries)].reshape(1, -1), 3)
+        searches += 1
+
+    out = state("follower", shard)
+    out["searches"] = searches
+    results.put(out)
+
+
+# ---------------- CHECK ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process catalog consistency check")
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--books", type=int, default=150, help="books per writer")
+    parser.add_argument("--compact-every", type=int, default=25)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bookshared_")
+
+    # spawned children import image_search fresh and read these
+    os.environ["BOOK_DATA_DIR"] = os.path.join(workdir, "data")
+    os.environ["BOOK_LOG_COMPACT_EVERY"] = str(args.compact_every)
+
+    ctx = mp.get_context("spawn")
+    wrote, results, done = ctx.Queue(), ctx.Queue(), ctx.Event()
+
+    procs = [ctx.Process(target=follower, args=(done, results))]
+    procs += [ctx.Process(target=writer, args=(i, args.books, wrote, done, results)) for i in range(args.writers)]
+
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+
+    try:
+        finished = 0
+        while finished < args.writers:
+            try:
+                wrote.get(timeout=1)
+                finished += 1
+            except queue.Empty:
+                # a crashed child would otherwise leave us waiting forever
+                if any(p.exitcode not in (0, None) for p in procs) or time.perf_counter() - start > args.timeout:
+                    print("❌ A process died or timed out", file=sys.stderr)
+                    sys.exit(1)
+        write_s = time.perf_counter() - start
+
+        done.set()
+        states = [results.get(timeout=args.timeout) for _ in procs]
+    finally:
+        done.set()
+        for p in procs:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+
+    import image_search
+
+    fresh = image_search.Shard(image_search.GLOBAL_SHARD)
+    fresh.load_db()
+    states.append(state("fresh", fresh))
+
+    expected = sorted(f"writer{i}_{j}" for i in range(args.writers) for j in range(args.books))
+    failures = []
+
+    for s in states:
+        if s["titles"] != expected:
+            failures.append(f"{s['role']}: {s['unique']} titles, expected {len(expected)}")
+        if s["books"] != s["unique"]:
+            failures.append(f"{s['role']}: {s['books'] - s['unique']} duplicated books")
+        if s["ntotal"] != s["books"]:
+            failures.append(f"{s['role']}: index.ntotal {s['ntotal']} != {s['books']} books")
+
+    report = {
+        "writers": args.writers,
+        "books_per_writer": args.books,
+        "compact_every": args.compact_every,
+        "write_s": round(write_s, 3),
+        "exit_codes": [p.exitcode for p in procs],
+        "processes": [{k: v for k, v in s.items() if k != "titles"} for s in states],
+        "failures": failures,
+    }
+    print(json.dumps(report, indent=2))
+
+    if failures or any(p.exitcode not in (0, None) for p in procs):
+        print("❌ Processes disagree about the catalog", file=sys.stderr)
+        sys.exit(1)
+
+    print("✅ All processes hold the same catalog", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
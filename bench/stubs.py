@@ -0,0 +1,136 @@
+"""
+Local stand-ins for Firebase and Groq so benchmarks never leave the box.
+
+install() must run before `main` (or anything importing firebase_service)
+is imported.
+"""
+
+import sys
+import json
+import time
+import types
+import requests
+
+
+# =========================================================
+# 🔥 FIREBASE STUB
+# same functions as firebase_service, backed by a dict
+# =========================================================
+FIRESTORE_LATENCY = 0.005   # seconds per simulated round-trip
+
+_owned = {}
+
+
+def _firestore_rtt():
+    if FIRESTORE_LATENCY:
+        time.sleep(FIRESTORE_LATENCY)
+
+
+def verify_user(id_token: str):
+    if not id_token:
+        return None
+    return f"bench-{id_token}"
+
+
+def user_has_book(uid: str, title: str) -> bool:
+    _firestore_rtt()
+    return title in _owned.get(uid, set())
+
+
+def user_in_library(uid: str, library_id: str) -> bool:
+    _firestore_rtt()
+    return True
+
+
+def save_book_for_user(uid: str, title: str):
+    _firestore_rtt()
+    _owned.setdefault(uid, set()).add(title)
+    return True
+
+
+def user_has_books(uid: str, titles) -> dict:
+    _firestore_rtt()
+    owned = _owned.get(uid, set())
+    return {title: title in owned for title in titles}
+
+
+def save_books_for_user(uid: str, titles):
+    _firestore_rtt()
+    _owned.setdefault(uid, set()).update(titles)
+    return True
+
+
+def _install_firebase():
+    module = types.ModuleType("firebase_service")
+    module.verify_user = verify_user
+    module.user_has_book = user_has_book
+    module.user_in_library = user_in_library
+    module.save_book_for_user = save_book_for_user
+    module.user_has_books = user_has_books
+    module.save_books_for_user = save_books_for_user
+    sys.modules["firebase_service"] = module
+
+
+# =========================================================
+# 🤖 GROQ / OPENLIBRARY / WIKIPEDIA STUB
+# canned JSON after a fixed delay
+# =========================================================
+REMOTE_LATENCY = 0.05
+
+_real_post = requests.post
+_real_get = requests.get
+
+
+class FakeResponse:
+
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self._data
+
+
+def _fake_post(url, *args, **kwargs):
+    if "api.groq.com" not in url:
+        return _real_post(url, *args, **kwargs)
+
+    time.sleep(REMOTE_LATENCY)
+
+    payload = kwargs.get("json") or {}
+    content = payload.get("messages", [{}])[-1].get("content")
+
+    # vision call sends a list (text + image), summary sends a string
+    if isinstance(content, list):
+        text = "The Hobbit - J.R.R. Tolkien"
+    else:
+        text = "A short overview for students."
+
+    return FakeResponse({"choices": [{"message": {"content": text}}]})
+
+
+def _fake_get(url, *args, **kwargs):
+    if "openlibrary.org" in url:
+        time.sleep(REMOTE_LATENCY)
+        return FakeResponse({"docs": [{
+            "title": "The Hobbit",
+            "author_name": ["J.R.R. Tolkien"],
+            "first_sentence": ["In a hole in the ground there lived a hobbit."]
+        }]})
+
+    if "wikipedia.org" in url:
+        time.sleep(REMOTE_LATENCY)
+        return FakeResponse({"extract": "A fantasy novel."})
+
+    return _real_get(url, *args, **kwargs)
+
+
+def _install_remote():
+    requests.post = _fake_post
+    requests.get = _fake_get
+
+
+def install():
+    _install_firebase()
+    _install_remote()
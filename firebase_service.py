@@ -5,6 +5,12 @@ import os
 import json
 import re
 import time
+from metrics import span, CACHE
+from admission import remote_timeout, check_deadline, DeadlineExceeded
+
+# seconds per Firestore / auth round-trip, cut short by the request deadline
+# → a slow Firestore can't pin REMOTE_POOL threads past the request
+FIRESTORE_TIMEOUT = float(os.environ.get("BOOKAI_FIRESTORE_TIMEOUT", "10"))
 
 # ---------------- INIT FIREBASE ----------------
 if not firebase_admin._apps:
@@ -15,10 +21,14 @@ if not firebase_admin._apps:
 
     cred_dict = json.loads(firebase_json)
     cred = credentials.Certificate(cred_dict)
-    firebase_admin.initialize_app(cred)
+    # bounds firebase_admin's own HTTP calls (token verification certs)
+    firebase_admin.initialize_app(cred, {"httpTimeout": FIRESTORE_TIMEOUT})
 
 db = firestore.client()
 
+# Firestore caps a write batch at 500 operations
+FIRESTORE_BATCH_LIMIT = 500
+
 
 # =========================================================
 # 🔐 TOKEN CACHE (CRITICAL RENDER FIX)
@@ -41,11 +51,18 @@ def verify_user(id_token: str):
     if id_token in _last_verify:
         uid, exp = _last_verify[id_token]
         if time.time() < exp:
+            CACHE.inc("token", "hit")
             return uid
 
+    CACHE.inc("token", "miss")
+
+    # no per-call timeout in firebase_admin → at least don't start late
+    check_deadline()
+
     # ---------- VERIFY ----------
     try:
-        decoded = auth.verify_id_token(id_token)
+        with span("firebase_verify"):
+            decoded = auth.verify_id_token(id_token)
 
         uid = decoded["uid"]
 
@@ -74,18 +91,55 @@ def book_id(title: str) -> str:
     return hashlib.md5(normalized.encode()).hexdigest()
 
 
+def book_ref(uid: str, title: str):
+    return (
+        db.collection("users")
+        .document(uid)
+        .collection("books")
+        .document(book_id(title))
+    )
+
+
+def _chunks(items, size=FIRESTORE_BATCH_LIMIT):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 # =========================================================
-# 🔍 CHECK USER HAS BOOK
+# 🏛️ CHECK LIBRARY MEMBERSHIP
+# libraries/<id>/members/<uid> exists → uid may read and add
+# to that library's collection
 # =========================================================
-def user_has_book(uid: str, title: str) -> bool:
+def user_in_library(uid: str, library_id: str) -> bool:
     try:
         doc_ref = (
-            db.collection("users")
+            db.collection("libraries")
+            .document(library_id)
+            .collection("members")
             .document(uid)
-            .collection("books")
-            .document(book_id(title))
         )
-        return doc_ref.get().exists
+        with span("firestore_read"):
+            return doc_ref.get(timeout=remote_timeout(FIRESTORE_TIMEOUT)).exists
+
+    except DeadlineExceeded:
+        raise
+
+    except Exception as e:
+        print("🔥 Firebase membership error:", e)
+        return False
+
+
+# =========================================================
+# 🔍 CHECK USER HAS BOOK
+# =========================================================
+def user_has_book(uid: str, title: str) -> bool:
+    try:
+        doc_ref = book_ref(uid, title)
+        with span("firestore_read"):
+            return doc_ref.get(timeout=remote_timeout(FIRESTORE_TIMEOUT)).exists
+
+    except DeadlineExceeded:
+        raise
 
     except Exception as e:
         print("🔥 Firebase check error:", e)
@@ -98,22 +152,91 @@ def user_has_book(uid: str, title: str) -> bool:
 def save_book_for_user(uid: str, title: str):
 
     try:
-        doc_ref = (
-            db.collection("users")
-            .document(uid)
-            .collection("books")
-            .document(book_id(title))
-        )
+        doc_ref = book_ref(uid, title)
 
-        doc_ref.set({
-            "title": title,
-            "normalized": normalize_title(title),
-            "createdAt": firestore.SERVER_TIMESTAMP
-        }, merge=True)
+        with span("firestore_write"):
+            doc_ref.set({
+                "title": title,
+                "normalized": normalize_title(title),
+                "createdAt": firestore.SERVER_TIMESTAMP
+            }, merge=True, timeout=remote_timeout(FIRESTORE_TIMEOUT))
 
         print(f"📘 Saved for user {uid}: {title}")
         return True
 
+    except DeadlineExceeded:
+        raise
+
     except Exception as e:
         print("🔥 Firebase save error:", e)
-        return False
\ No newline at end of file
+        return False
+
+
+# =========================================================
+# 🔍 CHECK MANY BOOKS (one get_all per chunk)
+# returns {title: owned}
+# =========================================================
+def user_has_books(uid: str, titles) -> dict:
+    titles = list(titles)
+    owned = {title: False for title in titles}
+
+    # several titles can normalize to the same document
+    by_id = {}
+    for title in titles:
+        by_id.setdefault(book_id(title), []).append(title)
+
+    try:
+        for ids in _chunks(list(by_id)):
+            refs = [book_ref(uid, by_id[i][0]) for i in ids]
+
+            with span("firestore_read_batch"):
+                snapshots = list(db.get_all(refs, timeout=remote_timeout(FIRESTORE_TIMEOUT)))
+
+            for snap in snapshots:
+                if snap.exists:
+                    for title in by_id.get(snap.id, []):
+                        owned[title] = True
+
+        return owned
+
+    except DeadlineExceeded:
+        raise
+
+    except Exception as e:
+        print("🔥 Firebase batch check error:", e)
+        return owned
+
+
+# =========================================================
+# 💾 SAVE MANY BOOKS (write batches ≤ FIRESTORE_BATCH_LIMIT)
+# =========================================================
+def save_books_for_user(uid: str, titles):
+
+    # first title wins for each normalized document
+    unique = {}
+    for title in titles:
+        unique.setdefault(book_id(title), title)
+
+    try:
+        for chunk in _chunks(list(unique.values())):
+            batch = db.batch()
+
+            for title in chunk:
+                batch.set(book_ref(uid, title), {
+                    "title": title,
+                    "normalized": normalize_title(title),
+                    "createdAt": firestore.SERVER_TIMESTAMP
+                }, merge=True)
+
+            with span("firestore_write_batch"):
+                batch.commit(timeout=remote_timeout(FIRESTORE_TIMEOUT))
+
+        print(f"📘 Saved {len(unique)} books for user {uid}")
+        return True
+
+    except DeadlineExceeded:
+        raise
+
+    except Exception as e:
+        print("🔥 Firebase batch save error:", e)
+        return False
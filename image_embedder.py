@@ -4,6 +4,9 @@ from PIL import Image
 from torchvision import transforms
 import timm
 import os
+import time
+from metrics import span, MODEL_LOAD_SECONDS
+from admission import check_deadline, DeadlineExceeded
 
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
 
@@ -12,30 +15,65 @@ torch.backends.mkldnn.enabled = False
 
 device = "cpu"
 
+# =========================================================
+# 🏷 EMBEDDER VERSIONS
+# every stored vector is tagged with the version that made it.
+# never edit a released entry — add a new one, point
+# BOOK_EMBEDDER_VERSION at it and let migrate_embeddings re-embed
+# =========================================================
+EMBEDDERS = {
+    "v1": {
+        "backbone": "convnext_tiny",
+        "dim": 768,
+        "resize": 256,
+        "crop": 224,
+        "contrast": 1.15,     # remove_lighting
+        "inner_crop": 0.12,   # second pass margin
+    },
+}
+
+# version new books are embedded with (and migrated to)
+EMBEDDER_VERSION = os.environ.get("BOOK_EMBEDDER_VERSION", "v1")
+
 # ---------------- LAZY MODEL ----------------
-model = None
+_models = {}
+_transforms = {}
+
 
-def get_model():
-    global model
+def get_model(version=None):
+    backbone = EMBEDDERS[version or EMBEDDER_VERSION]["backbone"]
+
+    model = _models.get(backbone)
     if model is None:
-        print("🧠 Loading AI vision model (first request only)...")
-        model = timm.create_model("convnext_tiny", pretrained=True, num_classes=0)
+        print(f"🧠 Loading AI vision model {backbone} (first request only)...")
+        start = time.perf_counter()
+        model = timm.create_model(backbone, pretrained=True, num_classes=0)
         model.eval()
         model.to(device)
+        _models[backbone] = model
+        MODEL_LOAD_SECONDS.set(backbone, value=time.perf_counter() - start)
         print("✅ Vision model ready")
     return model
 
 
 # -------- TRANSFORM --------
-transform = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize(
-        mean=[0.485, 0.456, 0.406],
-        std=[0.229, 0.224, 0.225]
-    )
-])
+def get_transform(version=None):
+    version = version or EMBEDDER_VERSION
+
+    transform = _transforms.get(version)
+    if transform is None:
+        spec = EMBEDDERS[version]
+        transform = transforms.Compose([
+            transforms.Resize(spec["resize"]),
+            transforms.CenterCrop(spec["crop"]),
+            transforms.ToTensor(),
+            transforms.Normalize(
+                mean=[0.485, 0.456, 0.406],
+                std=[0.229, 0.224, 0.225]
+            )
+        ])
+        _transforms[version] = transform
+    return transform
 
 
 def normalize(v):
@@ -44,44 +82,59 @@ def normalize(v):
     return v / norm
 
 
-def remove_lighting(img):
+def remove_lighting(img, contrast=1.15):
     arr = np.array(img).astype("float32")
     mean = arr.mean()
-    arr = (arr - mean) * 1.15 + 128
+    arr = (arr - mean) * contrast + 128
     arr = np.clip(arr, 0, 255)
     return Image.fromarray(arr.astype("uint8"))
 
 
-def extract(img):
-    model = get_model()   # 🔥 LAZY LOAD HERE
-    tensor = transform(img).unsqueeze(0).to(device)
-    with torch.no_grad():
+def extract(img, version=None):
+    model = get_model(version)   # 🔥 LAZY LOAD HERE
+    with span("transform"):
+        tensor = get_transform(version)(img).unsqueeze(0).to(device)
+    with span("forward"), torch.no_grad():
         emb = model(tensor).cpu().numpy().astype("float32")
     return emb
 
 
-def get_image_embedding(path):
+def get_image_embedding(path, version=None):
+    spec = EMBEDDERS.get(version or EMBEDDER_VERSION)
+
+    if spec is None:
+        print("Embedding error: unknown embedder version", version)
+        return None
+
     try:
         img = Image.open(path)
         img.load()
         img = img.convert("RGB")
         img = img.copy()
 
-        img = remove_lighting(img)
+        with span("remove_lighting"):
+            img = remove_lighting(img, spec["contrast"])
 
         embeddings = []
 
-        embeddings.append(extract(img))
+        embeddings.append(extract(img, version))
+
+        # request abandoned → skip the second forward pass
+        check_deadline()
 
+        m = spec["inner_crop"]
         w, h = img.size
-        crop = img.crop((w*0.12, h*0.12, w*0.88, h*0.88))
-        embeddings.append(extract(crop))
+        crop = img.crop((w*m, h*m, w*(1-m), h*(1-m)))
+        embeddings.append(extract(crop, version))
 
         emb = np.mean(np.vstack(embeddings), axis=0, keepdims=True)
 
         del img
         return normalize(emb)
 
+    except DeadlineExceeded:
+        raise
+
     except Exception as e:
         print("Embedding error:", e)
         return None
\ No newline at end of file
@@ -1,23 +1,119 @@
 import os
 import json
+import hashlib
+import fcntl
+import uuid
+import shutil
 import faiss
 import numpy as np
-import time
-from image_embedder import get_image_embedding
-from threading import Lock
-
-DATA_FILE = "data/books.json"
-DIM = 768
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from image_embedder import get_image_embedding, EMBEDDERS, EMBEDDER_VERSION
+from metrics import span, Gauge
+from admission import check_deadline
+from threading import Lock, Condition, Thread
+
+# DATA_DIR can point at a volume shared by several workers / containers.
+# (flock is reliable on local disks; on NFS use a single writer node)
+DATA_DIR = os.environ.get("BOOK_DATA_DIR", "data")
+SHARDS_DIR = os.path.join(DATA_DIR, "shards")
+DIM = EMBEDDERS[EMBEDDER_VERSION]["dim"]
+
+# catalogs written before embeddings were versioned live in the shard root;
+# every other version gets <shard>/spaces/<version>/
+LEGACY_VERSION = "v1"
 
 MATCH_THRESHOLD = 0.72
 DUPLICATE_THRESHOLD = 0.87
 
-os.makedirs("data", exist_ok=True)
-
-_books = []
-_index = None
-_lock = Lock()
-_loaded = False   # lazy load flag
+# fold the log into the snapshot after this many appends
+COMPACT_EVERY = int(os.environ.get("BOOK_LOG_COMPACT_EVERY", "500"))
+
+# in-RAM index per shard; full vectors stay on disk for exact re-scoring
+#   flat → float32, exact (3 KB/book)
+#   fp16 → float16 first pass (1.5 KB/book)
+#   pq   → product-quantized codes, PQ_M bytes/book (needs PQ_TRAIN_MIN books)
+INDEX_MODE = os.environ.get("BOOK_INDEX_MODE", "flat")
+PQ_M = int(os.environ.get("BOOK_PQ_M", "96"))
+PQ_NBITS = 8
+# faiss needs at least one training row per centroid (2^nbits per sub-quantizer)
+PQ_TRAIN_MIN = max(int(os.environ.get("BOOK_PQ_TRAIN_MIN", "10000")), 2 ** PQ_NBITS)
+PQ_TRAIN_SAMPLE = 65536
+RERANK_CANDIDATES = int(os.environ.get("BOOK_RERANK_CANDIDATES", "32"))
+
+# shard fan-out threads (faiss releases the GIL while searching)
+SEARCH_WORKERS = int(os.environ.get("BOOK_SEARCH_WORKERS", "4"))
+
+# public catalog everybody searches; lives directly in DATA_DIR
+GLOBAL_SHARD = "global"
+
+# loaded shard spaces kept in RAM; least recently used private ones are dropped
+MAX_LOADED_SHARDS = int(os.environ.get("BOOK_MAX_LOADED_SHARDS", "128"))
+
+os.makedirs(DATA_DIR, exist_ok=True)
+
+_shards = OrderedDict()
+_shards_lock = Lock()
+_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+
+# summed per kind → private shard names (uids) never become labels
+def _books_by_kind():
+    totals = {}
+    for (name, version), s in list(_shards.items()):
+        key = (shard_kind(name), version)
+        totals[key] = totals.get(key, 0) + len(s.books)
+    return totals
+
+
+INDEX_BOOKS = Gauge(
+    "bookai_index_books",
+    "Vectors held in loaded shard spaces, per shard kind",
+    labels=("kind", "version"),
+    fn=_books_by_kind
+)
+
+
+# ---------------- READER / WRITER LOCK ----------------
+# faiss indexes must not be searched while rows are being added;
+# many searches may run together, a writer waits for them and
+# new readers wait behind a waiting writer
+class RWLock:
+
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
 
 
 # ---------------- NORMALIZE ----------------
@@ -27,139 +123,815 @@ def normalize(v):
     return v / norm
 
 
-# ---------------- REBUILD INDEX ----------------
-def rebuild_index():
-    global _index
+# ---------------- SHARD NAMES ----------------
+# global            → public catalog
+# user:<uid>        → a user's private collection
+# library:<id>      → an institution's collection
+def user_shard(uid: str) -> str:
+    return f"user:{uid}"
 
-    _index = faiss.IndexFlatIP(DIM)
 
-    if len(_books) == 0:
-        return
+def library_shard(library_id: str) -> str:
+    return f"library:{library_id}"
 
-    vectors = []
-    for b in _books:
-        if "embedding" in b:
-            vec = np.array(b["embedding"], dtype="float32").reshape(1, -1)
-            vec = normalize(vec)
-            vectors.append(vec[0])
 
-    if len(vectors):
-        _index.add(np.stack(vectors))
+# global / user / library — safe to use as a metric label
+def shard_kind(name: str) -> str:
+    return name.split(":", 1)[0]
 
 
-# ---------------- LOAD DB ----------------
-def load_db():
-    global _books
+# hashed → distinct names never share a directory (user:a.b vs user:a_b)
+def shard_dir(name: str) -> str:
+    if name == GLOBAL_SHARD:
+        return DATA_DIR
+    return os.path.join(SHARDS_DIR, hashlib.sha1(name.encode()).hexdigest())
 
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as f:
-            _books = json.load(f)
-    else:
-        _books = []
 
-    rebuild_index()
+def shard_exists(name: str) -> bool:
+    return name == GLOBAL_SHARD or os.path.isdir(shard_dir(name))
+
+
+def space_dir(name: str, version: str) -> str:
+    if version == LEGACY_VERSION:
+        return shard_dir(name)
+    return os.path.join(shard_dir(name), "spaces", version)
+
 
+# =========================================================
+# 🏷 EMBEDDING SPACES
+# space.json in the shard root says which version is live:
+#   active → fully populated space
+#   legacy → older spaces kept for books with no stored cover,
+#            until retired (migrate_embeddings.py retire <version>)
+# searches also cover EMBEDDER_VERSION while it is being filled;
+# empty spaces are skipped so they never cost an extra embedding
+# =========================================================
+# LRU, same bound as the shard registry (entries are tiny, but one per user)
+_space_cache = OrderedDict()
+_space_lock = Lock()
 
-# ---------------- ENSURE LOADED ----------------
-def ensure_loaded():
-    global _loaded
-    if _loaded:
-        return
 
-    print("📚 Loading book database (first request only)...")
-    load_db()
-    _loaded = True
-    print("✅ Book DB Ready")
+def read_space(name: str) -> dict:
+    path = os.path.join(shard_dir(name), "space.json")
 
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {"active": LEGACY_VERSION, "legacy": []}
 
-# ---------------- FORCE RELOAD ----------------
-def force_reload():
-    global _loaded
-    _loaded = False
-    ensure_loaded()
+    with _space_lock:
+        cached = _space_cache.get(name)
+        if cached and cached[0] == mtime:
+            _space_cache.move_to_end(name)
+            return cached[1]
 
+    with open(path, "r") as f:
+        state = json.load(f)
 
-# ---------------- WAIT UNTIL INDEX READY ----------------
-def wait_until_index_ready(timeout=5):
-    start = time.time()
-    while True:
-        if _index is not None and getattr(_index, "ntotal", 0) == len(_books):
-            return True
-        if time.time() - start > timeout:
-            print("⚠️ FAISS rebuild timeout")
-            return False
-        time.sleep(0.05)
+    with _space_lock:
+        _space_cache[name] = (mtime, state)
+        _space_cache.move_to_end(name)
+        while len(_space_cache) > MAX_LOADED_SHARDS:
+            _space_cache.popitem(last=False)
 
+    return state
 
-# ---------------- SAVE DB ----------------
-def save_db():
-    tmp = DATA_FILE + ".tmp"
+
+def write_space(name: str, active: str, legacy=()):
+    path = os.path.join(shard_dir(name), "space.json")
+    tmp = path + ".tmp"
     with open(tmp, "w") as f:
-        json.dump(_books, f)
-    os.replace(tmp, DATA_FILE)
+        json.dump({"active": active, "legacy": list(legacy)}, f)
+    os.replace(tmp, path)
+
+
+# a few stats, no load → cheap enough for every search;
+# snapshots only come from compactions, so any non-empty one has books
+# and before the first one every add sits in the generation 0 log
+def space_has_books(name: str, version: str) -> bool:
+    root = space_dir(name, version)
+    for file, empty in (("books.json", len("[]")), ("books.0.log", 0), ("books.log", 0)):
+        try:
+            if os.path.getsize(os.path.join(root, file)) > empty:
+                return True
+        except FileNotFoundError:
+            pass
+    return False
+
+
+_unknown_versions = set()
+
+
+# versions this worker has no embedder for (space.json written by newer
+# code) are skipped rather than failing every search
+def searchable_versions(name: str):
+    state = read_space(name)
+    versions = []
+    for v in [state["active"]] + state.get("legacy", []) + [EMBEDDER_VERSION]:
+        if v in versions:
+            continue
+        if v not in EMBEDDERS:
+            if v not in _unknown_versions:
+                _unknown_versions.add(v)
+                print(f"⚠️ Unknown embedding version '{v}' in space.json → not searched by this worker")
+            continue
+        if space_has_books(name, v):
+            versions.append(v)
+    return versions
+
+
+# ---------------- VECTOR FILE ----------------
+def _empty_rows(dim=DIM):
+    return np.zeros((0, dim), dtype="float32")
+
+
+def _map_rows(path, count, dim=DIM):
+    # read-only map → pages load on first touch and are shared between workers
+    if count == 0 or not os.path.exists(path):
+        return _empty_rows(dim)
+    return np.memmap(path, dtype="float32", mode="r", shape=(count, dim))
+
+
+def _iter_rows(vectors, pending, chunk=65536):
+    for i in range(0, len(vectors), chunk):
+        yield np.asarray(vectors[i:i + chunk])
+    if pending:
+        yield np.stack(pending)
+
+
+# ---------------- INDEX FACTORY ----------------
+# iter_rows → callable yielding row chunks (only read when PQ needs training)
+# train=False → never train here (pq falls back to fp16)
+def make_index(total, iter_rows, mode=None, dim=DIM, train=True):
+    mode = mode or INDEX_MODE
+
+    if mode == "pq" and train and total >= PQ_TRAIN_MIN:
+        index = faiss.IndexPQ(dim, PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+
+        sample, seen = [], 0
+        for chunk in iter_rows():
+            sample.append(chunk[:PQ_TRAIN_SAMPLE - seen])
+            seen += len(sample[-1])
+            if seen >= PQ_TRAIN_SAMPLE:
+                break
+
+        index.train(np.ascontiguousarray(np.vstack(sample)))
+        return index
+
+    # small shards can't train PQ → fp16 until they grow
+    if mode in ("fp16", "pq"):
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+
+    return faiss.IndexFlatIP(dim)
+
+
+# =========================================================
+# 📦 SHARD
+# one FAISS index + snapshot + append log for one embedding
+# version; every worker keeps its own copy in memory and
+# follows the log of the others
+#
+# on disk:
+#   books.json   → metadata only (title, ...) in row order, plus the
+#                  generation it was written for
+#   vectors.f32  → full-precision rows, memory-mapped on demand
+#   books.<gen>.log → appends since that snapshot (with embeddings)
+#   books.version → latest generation; written last, only tells other
+#                  workers to reload (books.json is the source of truth)
+#   index.pq     → trained PQ index for the first snapshot rows (pq mode)
+#   ../images/   → source covers (shard root), kept for re-embedding
+# older snapshots kept embeddings inside books.json, or were a plain list
+# followed by a single books.log; those still load and are converted
+# on the next compaction
+# =========================================================
+class Shard:
+
+    def __init__(self, name: str, version: str = LEGACY_VERSION):
+        self.name = name
+        self.version = version
+        self.dim = EMBEDDERS[version]["dim"]
+        self.root = shard_dir(name)
+        self.dir = space_dir(name, version)
+
+        self.data_file = os.path.join(self.dir, "books.json")        # snapshot
+        self.vectors_file = os.path.join(self.dir, "vectors.f32")    # snapshot rows
+        self.log_file = self.log_path(0)                             # appends since snapshot
+        self.version_file = os.path.join(self.dir, "books.version")  # snapshot generation
+        self.lock_file = os.path.join(self.dir, "books.lock")
+        self.index_file = os.path.join(self.dir, "index.pq")         # trained PQ codes
+        self.train_lock_file = os.path.join(self.dir, "train.lock")
+
+        self.books = []
+        self.index = None
+        self.lock = Lock()    # serializes writers / loaders in this process
+        self.rw = RWLock()    # guards books / rows / index against live searches
+        self.loaded = False   # lazy load flag
+
+        self.vectors = _empty_rows(self.dim)  # snapshot rows (memmap)
+        self.pending = []             # rows not in vectors.f32 yet
+
+        self.generation = 0   # snapshot generation this process has loaded
+        self.snapshot_id = None   # (inode, mtime) of the loaded books.json
+        self.log_offset = 0   # bytes of log_file already applied
+        self.log_entries = 0  # entries in log_file (compaction trigger)
+
+        self.saved_rows = 0     # rows held by index_file
+        self.training = False   # PQ training thread running in this process
+
+    # ---------------- CROSS-PROCESS LOCK ----------------
+    # shared → readers applying the log / snapshot
+    # exclusive → the single writer appending or compacting
+    @contextmanager
+    def file_lock(self, exclusive=False):
+        os.makedirs(self.dir, exist_ok=True)
+
+        # new file description per call so threads don't share (and convert) a lock
+        with open(self.lock_file, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read_generation(self):
+        try:
+            with open(self.version_file, "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    # unique tmp → readers repairing it under the shared lock can't collide
+    def write_generation(self, gen):
+        tmp = f"{self.version_file}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w") as f:
+            f.write(str(gen))
+        os.replace(tmp, self.version_file)
+
+    # changes whenever books.json is replaced, even if books.version wasn't
+    def read_snapshot_id(self):
+        try:
+            st = os.stat(self.data_file)
+            return st.st_ino, st.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    # gen None → layout from before per-generation logs
+    def log_path(self, gen):
+        return os.path.join(self.dir, "books.log" if gen is None else f"books.{gen}.log")
+
+    def log_size(self):
+        try:
+            return os.path.getsize(self.log_file)
+        except FileNotFoundError:
+            return 0
+
+    # ---------------- FULL-PRECISION ROWS ----------------
+    def row(self, idx):
+        snap = len(self.vectors)
+        return self.vectors[idx] if idx < snap else self.pending[idx - snap]
+
+    def rows(self, ids):
+        return np.stack([self.row(int(i)) for i in ids])
+
+    def iter_rows(self, chunk=65536):
+        return _iter_rows(self.vectors, self.pending, chunk)
+
+    # ---------------- APPEND TO MEMORY ----------------
+    def apply_entries(self, entries):
+        books, vectors = [], []
+
+        for b in entries:
+            if "embedding" not in b:
+                continue
+            vectors.append(b["embedding"])
+            books.append({k: v for k, v in b.items() if k != "embedding"})
+
+        if not vectors:
+            return
+
+        rows = normalize(np.array(vectors, dtype="float32"))
+
+        with self.rw.write():
+            self.books.extend(books)
+            self.pending.extend(rows)
+            self.index.add(rows)
+
+    # ---------------- READ LOG TAIL ----------------
+    def read_log(self, offset):
+        if not os.path.exists(self.log_file):
+            return [], offset
+
+        with open(self.log_file, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        # only consume complete lines
+        end = data.rfind(b"\n") + 1
+        entries = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        return entries, offset + end
+
+    # ---------------- REBUILD INDEX ----------------
+    # loads never train: they start from index.pq when there is one
+    # (and only encode the rows after it), else fall back to fp16
+    def build_index(self, vectors, pending, train=False):
+        index = None if train else self.read_saved_index(len(vectors))
+
+        if index is None:
+            index = make_index(len(vectors) + len(pending), lambda: _iter_rows(vectors, pending), dim=self.dim, train=train)
+
+        for chunk in _iter_rows(vectors[index.ntotal:], pending):
+            index.add(chunk)
+        return index
+
+    # full rebuild that trains PQ inline → offline tools only
+    def rebuild_index(self):
+        index = self.build_index(self.vectors, self.pending, train=True)
+
+        with self.rw.write():
+            self.index = index
+
+    # ---------------- SAVED PQ INDEX ----------------
+    def read_saved_index(self, rows):
+        if INDEX_MODE != "pq" or not os.path.exists(self.index_file):
+            return None
+
+        index = faiss.read_index(self.index_file)
+        if index.d != self.dim or index.ntotal > rows:
+            return None
+
+        self.saved_rows = index.ntotal
+        return index
+
+    # caller holds self.lock and the exclusive file lock
+    def save_index(self):
+        tmp = self.index_file + ".tmp"
+        faiss.write_index(self.index, tmp)
+        os.replace(tmp, self.index_file)
+        self.saved_rows = self.index.ntotal
+
+    # ---------------- PQ TRAINING ----------------
+    # training takes seconds to minutes → background thread, no locks held;
+    # one process per space trains, the next compaction writes index.pq
+    # and every other worker picks it up on reload
+    def maybe_train(self):
+        if INDEX_MODE != "pq" or self.training or isinstance(self.index, faiss.IndexPQ):
+            return
+        if len(self.vectors) < PQ_TRAIN_MIN:
+            return
+
+        self.training = True
+        Thread(target=self.train_pq, name=f"pq-train-{self.version}", daemon=True).start()
+
+    def train_pq(self):
+        try:
+            with open(self.train_lock_file, "a+") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+
+                try:
+                    # trained by another worker while we waited
+                    if not os.path.exists(self.index_file):
+                        self.train_pq_unlocked()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+        except Exception as e:
+            print("🔥 PQ training error:", e)
+
+        finally:
+            self.training = False
+
+    def train_pq_unlocked(self):
+        # snapshot rows are append-only on disk → safe to read without locks
+        vectors = self.vectors
+        print(f"🧠 Training PQ for '{self.name}' {self.version} on {len(vectors)} books...")
+
+        index = make_index(len(vectors), lambda: _iter_rows(vectors, []), mode="pq", dim=self.dim)
+        for chunk in _iter_rows(vectors, []):
+            index.add(chunk)
+
+        with self.lock:
+            with self.file_lock(exclusive=True):
+                self.sync_locked()
+
+                # encode what arrived while training, then publish
+                for chunk in _iter_rows(self.vectors[len(vectors):], self.pending):
+                    index.add(chunk)
+
+                with self.rw.write():
+                    self.index = index
+
+                self.compact_locked()
+
+    # ---------------- LOAD DB ----------------
+    # caller holds the file lock (shared or exclusive)
+    # the new state is built aside and swapped in, so searches never see half of it
+    def load_locked(self):
+        generation = self.read_generation()
+        snapshot_id = self.read_snapshot_id()
+        folded, snapshot = None, []
+
+        if os.path.exists(self.data_file):
+            with open(self.data_file, "r") as f:
+                snapshot = json.load(f)
+
+        if isinstance(snapshot, dict):
+            folded, snapshot = snapshot["generation"], snapshot["books"]
+
+            # a compaction that died before books.version → its log is
+            # already folded in; bump the signal so nobody reloads forever
+            if folded != generation:
+                self.write_generation(folded)
+            generation = folded
+            log_file = self.log_path(generation)
+
+        elif os.path.exists(self.log_path(None)):
+            log_file = self.log_path(None)
+        else:
+            log_file = self.log_path(generation)
+
+        if snapshot and "embedding" in snapshot[0]:
+            # old format → rows come from the JSON until the next compaction
+            snapshot = [b for b in snapshot if "embedding" in b]
+            books = [{k: v for k, v in b.items() if k != "embedding"} for b in snapshot]
+            vectors = _empty_rows(self.dim)
+            pending = list(normalize(np.array([b["embedding"] for b in snapshot], dtype="float32")))
+        else:
+            books = snapshot
+            vectors = _map_rows(self.vectors_file, len(snapshot), self.dim)
+            pending = []
+
+        index = self.build_index(vectors, pending)
+
+        with self.rw.write():
+            self.books, self.vectors, self.pending, self.index = books, vectors, pending, index
+
+        self.generation = generation
+        self.snapshot_id = snapshot_id
+        self.log_file = log_file
+        entries, self.log_offset = self.read_log(0)
+        self.log_entries = len(entries)
+        self.apply_entries(entries)
+
+    def load_db(self):
+        # unknown shard → empty, don't create a directory just for a lookup
+        if not os.path.isdir(self.dir):
+            vectors = _empty_rows(self.dim)
+            index = self.build_index(vectors, [])
+
+            with self.rw.write():
+                self.books, self.vectors, self.pending, self.index = [], vectors, [], index
+            return
+
+        with self.file_lock():
+            self.load_locked()
+
+    # ---------------- ENSURE LOADED ----------------
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+
+        with self.lock:
+            if self.loaded:
+                return
+
+            print(f"📚 Loading shard '{self.name}' {self.version} (first request only)...")
+            self.load_db()
+            self.loaded = True
+            self.maybe_train()
+            print(f"✅ Shard '{self.name}' {self.version} ready ({len(self.books)} books, {INDEX_MODE} index)")
+
+    # ---------------- FORCE RELOAD ----------------
+    def force_reload(self):
+        self.loaded = False
+        self.ensure_loaded()
+
+    # ---------------- FOLLOW OTHER WORKERS ----------------
+    # caller holds self.lock and the file lock
+    def sync_locked(self):
+        size = self.log_size()
+
+        # a log never shrinks within a generation → smaller means it was replaced;
+        # a new books.json without a new books.version → compaction died halfway
+        changed = self.read_generation() != self.generation or self.read_snapshot_id() != self.snapshot_id
+
+        if changed or size < self.log_offset:
+            print(f"🔁 Shard '{self.name}' compacted elsewhere → reloading snapshot")
+            self.load_locked()
+            return
+
+        if size == self.log_offset:
+            return
+
+        entries, self.log_offset = self.read_log(self.log_offset)
+        self.log_entries += len(entries)
+        self.apply_entries(entries)
+
+    def sync(self):
+        self.ensure_loaded()
+
+        # cheap unlocked check first — most searches see no change
+        if self.read_generation() == self.generation and self.log_size() == self.log_offset:
+            return
+
+        with self.lock:
+            with self.file_lock():
+                self.sync_locked()
+
+    # ---------------- SAVE DB ----------------
+    # rows are only ever appended, so other workers' mmaps stay valid;
+    # anything past the loaded snapshot (e.g. a crashed compaction) is dropped first
+    def save_db(self, generation=None):
+        snap = len(self.vectors)
+        generation = self.generation if generation is None else generation
+
+        with open(self.vectors_file, "ab") as f:
+            f.truncate(snap * self.dim * 4)
+            for row in self.pending:
+                f.write(np.asarray(row, dtype="float32").tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        tmp = self.data_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"generation": generation, "books": self.books}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.data_file)
+
+    # ---------------- COMPACT ----------------
+    # caller holds self.lock and the exclusive file lock
+    # crash-safe at every step: the new snapshot names its own generation
+    # and log, so a half-done compaction either never happened or is done
+    def compact_locked(self):
+        generation = self.generation + 1
+
+        self.save_db(generation)
+        self.snapshot_id = self.read_snapshot_id()
+
+        # followers start from this instead of retraining; rewritten only
+        # once it lags by a tenth, the rest they encode themselves
+        if isinstance(self.index, faiss.IndexPQ) and self.index.ntotal - self.saved_rows > self.saved_rows // 10:
+            self.save_index()
+
+        self.write_generation(generation)
+        self.generation = generation
+        self.log_file = self.log_path(generation)
+        self.log_offset = 0
+        self.log_entries = 0
+
+        # folded into the snapshot (plus any a crashed compaction left behind)
+        for file in os.listdir(self.dir):
+            path = os.path.join(self.dir, file)
+            if file.startswith("books.") and file.endswith(".log") and path != self.log_file:
+                os.remove(path)
+
+        # pending rows are on disk now → drop them from RAM
+        vectors = _map_rows(self.vectors_file, len(self.books), self.dim)
+
+        with self.rw.write():
+            self.vectors, self.pending = vectors, []
+
+        # shard just grew big enough to train PQ
+        self.maybe_train()
+
+        print(f"🗜 Shard '{self.name}' compacted, generation", self.generation)
+
+    # ---------------- SEARCH ----------------
+    # emb must already be normalized; returns [(row id, score), ...]
+    # compact indexes only shortlist — scores are recomputed exactly
+    def topk(self, emb, k=1):
+        with self.rw.read():
+            return self.topk_locked(emb, k)
+
+    # caller holds self.rw.read()
+    def topk_locked(self, emb, k=1):
+        if self.index is None or getattr(self.index, "ntotal", 0) == 0:
+            return []
+
+        exact = isinstance(self.index, faiss.IndexFlat)
+        n = k if exact else max(k, RERANK_CANDIDATES)
+
+        with span("faiss_search"):
+            D, I = self.index.search(emb, n)
+
+        ids = [int(i) for i in I[0] if 0 <= i < len(self.books)]
+        if not ids:
+            return []
+
+        if exact:
+            scores = D[0][:len(ids)]
+        else:
+            with span("rerank"):
+                scores = self.rows(ids) @ emb[0]
+
+        ranked = sorted(zip(ids, scores), key=lambda p: p[1], reverse=True)[:k]
+        return [(i, float(s)) for i, s in ranked]
+
+    def search(self, emb, k=1):
+        self.sync()
+
+        with self.rw.read():
+            return [(self.books[i], score) for i, score in self.topk_locked(emb, k)]
+
+    # ---------------- ADD ----------------
+    # returns False when a near-identical cover is already stored
+    def add(self, emb, title, image=None, dedupe=True):
+        self.ensure_loaded()
+
+        with self.lock, span("index_add"):
+            with self.file_lock(exclusive=True):
+
+                # catch up first so duplicates added by other workers are seen
+                self.sync_locked()
+
+                # duplicate check
+                if dedupe:
+                    best = self.topk(emb, 1)
+                    if best and best[0][1] > DUPLICATE_THRESHOLD:
+                        print("⚠️ Already exists → not adding again")
+                        return False
+
+                entry = {
+                    "title": title,
+                    "version": self.version,
+                    "embedding": emb.flatten().tolist()
+                }
+                if image:
+                    entry["image"] = image
+
+                # append one full line → followers never see half an entry
+                with open(self.log_file, "ab") as f:
+                    f.write((json.dumps(entry) + "\n").encode())
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                self.apply_entries([entry])
+                self.log_offset = self.log_size()
+                self.log_entries += 1
+
+                if self.log_entries >= COMPACT_EVERY:
+                    self.compact_locked()
+
+        print(f"➕ Added to '{self.name}' {self.version}:", title)
+        return True
+
+
+# ---------------- SHARD REGISTRY ----------------
+# LRU: a request that still holds an evicted shard keeps using it safely,
+# the next lookup just loads it again
+def get_space(name: str = GLOBAL_SHARD, version: str = None) -> Shard:
+    version = version or read_space(name)["active"]
+    key = (name, version)
+
+    with _shards_lock:
+        shard = _shards.get(key)
+        if shard is not None:
+            _shards.move_to_end(key)
+            return shard
+
+        shard = _shards[key] = Shard(name, version)
+
+        for old in list(_shards):
+            if len(_shards) <= MAX_LOADED_SHARDS:
+                break
+            if old[0] != GLOBAL_SHARD:
+                del _shards[old]
+
+        return shard
+
+
+# directory names are hashed → shard.json remembers the real name
+def list_shards():
+    names = [GLOBAL_SHARD]
+
+    if os.path.isdir(SHARDS_DIR):
+        for entry in sorted(os.listdir(SHARDS_DIR)):
+            meta = os.path.join(SHARDS_DIR, entry, "shard.json")
+            if os.path.exists(meta):
+                with open(meta, "r") as f:
+                    names.append(json.load(f)["name"])
+
+    return names
+
+
+# ---------------- SOURCE IMAGES ----------------
+# covers are kept so a new embedder can re-embed them later
+def store_image(name, image_path):
+    root = shard_dir(name)
+    os.makedirs(os.path.join(root, "images"), exist_ok=True)
+
+    meta = os.path.join(root, "shard.json")
+    if name != GLOBAL_SHARD and not os.path.exists(meta):
+        with open(meta, "w") as f:
+            json.dump({"name": name}, f)
+
+    rel = os.path.join("images", f"{uuid.uuid4().hex}.jpg")
+    shutil.copyfile(image_path, os.path.join(root, rel))
+    return rel
+
+
+# =========================================================
+# 🔍 FAN-OUT SEARCH
+# embeds once per live version, searches every shard space in
+# parallel, merges top-k (one hit per book)
+# returns [(shard_name, book, score), ...] best first
+# =========================================================
+def search_books(image_path, shards=None, k=1):
+
+    # private shards nobody has added to yet have nothing to search
+    shards = [name for name in shards or [GLOBAL_SHARD] if shard_exists(name)]
+    targets = [(name, v) for name in shards for v in searchable_versions(name)]
+
+    if not targets:
+        return []
+
+    # two versions only while a migration is running
+    embs = {}
+    for version in dict.fromkeys(v for _, v in targets):
+        with span("embedding"):
+            emb = get_image_embedding(image_path, version)
+        if emb is None:
+            return []
+        embs[version] = normalize(emb)
+
+    check_deadline()
 
+    def _one(target):
+        name, version = target
+        return [(name, book, score) for book, score in get_space(name, version).search(embs[version], k)]
 
-# ---------------- SEARCH BOOK ----------------
-def search_book(image_path):
+    if len(targets) == 1:
+        partials = [_one(targets[0])]
+    else:
+        partials = list(_pool.map(_one, targets))
 
-    ensure_loaded()
+    merged = [hit for part in partials for hit in part]
+    merged.sort(key=lambda hit: hit[2], reverse=True)
 
-    if _index is None or getattr(_index, "ntotal", 0) == 0:
-        return None, 0
+    # the same book can sit in both the old and the new space
+    seen, unique = set(), []
+    for name, book, score in merged:
+        if (name, book["title"]) not in seen:
+            seen.add((name, book["title"]))
+            unique.append((name, book, score))
 
-    emb = get_image_embedding(image_path)
-    if emb is None:
-        return None, 0
+    return unique[:k]
 
-    emb = normalize(emb)
 
-    D, I = _index.search(emb, 1)
+# ---------------- SEARCH BOOK ----------------
+def search_book(image_path, shards=None):
 
-    score = float(D[0][0])
-    idx = int(I[0][0])
+    hits = search_books(image_path, shards, k=1)
 
-    if idx >= len(_books):
+    if not hits:
         return None, 0
 
+    _, book, score = hits[0]
+
     if score < MATCH_THRESHOLD:
         return None, score
 
-    return _books[idx], score
+    return book, score
 
 
 # ---------------- ADD BOOK ----------------
-def add_book(image_path, title):
-
-    ensure_loaded()
-
-    emb = get_image_embedding(image_path)
+# new books always go into the EMBEDDER_VERSION space.
+# embed_cover (CPU) and store_book (waits on the shard lock / flock behind
+# compactions and reloads) are split so callers can run them on different pools
+def embed_cover(image_path):
+    with span("embedding"):
+        emb = get_image_embedding(image_path, EMBEDDER_VERSION)
     if emb is None:
-        return False
+        return None
+    return normalize(emb)
 
-    emb = normalize(emb)
 
-    with _lock:
+# returns False when a near-identical cover is already stored
+def store_book(image_path, emb, title, shard=GLOBAL_SHARD):
 
-        # duplicate check
-        if _index is not None and getattr(_index, "ntotal", 0) > 0:
-            D, _ = _index.search(emb, 1)
-            if float(D[0][0]) > DUPLICATE_THRESHOLD:
-                print("⚠️ Already exists → not adding again")
-                return True
+    # never write a book the caller has already given up on
+    check_deadline()
+
+    image = store_image(shard, image_path)
+    added = False
 
-        # add new book
-        _books.append({
-            "title": title,
-            "embedding": emb.flatten().tolist()
-        })
+    try:
+        added = get_space(shard, EMBEDDER_VERSION).add(emb, title, image=image)
+    finally:
+        # duplicate (or failed write) → don't keep an orphaned cover
+        if not added:
+            os.remove(os.path.join(shard_dir(shard), image))
 
-        save_db()
+    return added
 
-        # rebuild index
-        force_reload()
 
-        # wait until ready
-        wait_until_index_ready()
+def add_book(image_path, title, shard=GLOBAL_SHARD):
+    emb = embed_cover(image_path)
+    if emb is None:
+        return False
 
-    print("➕ Added:", title)
-    return True
\ No newline at end of file
+    store_book(image_path, emb, title, shard)
+    return True
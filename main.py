@@ -1,15 +1,28 @@
 import os
+import re
+import hmac
 import uuid
 import shutil
-import asyncio
-from threading import Lock
+import time
+import threading
 from PIL import Image
 
+from typing import List
+from pydantic import BaseModel
 from fastapi import FastAPI, UploadFile, File, Request
-from fastapi.responses import JSONResponse
-
-from image_search import search_book, add_book
-from firebase_service import save_book_for_user, user_has_book, verify_user
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from image_search import search_book, embed_cover, store_book, GLOBAL_SHARD, user_shard, library_shard
+from firebase_service import (
+    save_book_for_user, save_books_for_user,
+    user_has_book, user_has_books, user_in_library, verify_user
+)
+from metrics import span, render, REQUEST_SECONDS, INFLIGHT
+from migrate_embeddings import start_background
+from admission import (
+    admit, run, check_deadline, Rejected, DeadlineExceeded,
+    EMBED_POOL, REMOTE_POOL, WRITE_POOL
+)
 
 # -------- FLOW 2 IMPORTS --------
 from vision_ai.vision import detect_book
@@ -23,11 +36,75 @@ UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 MAX_FILE_SIZE = 4 * 1024 * 1024
-index_lock = Lock()
+MAX_SHELF_FILES = 20
+MAX_SYNC_TITLES = 2000
+
+# also a Firestore document id and part of the shard name
+LIBRARY_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+TRACKED_ENDPOINTS = {"/scan", "/scan-shelf", "/add", "/sync", "/ask-book-ai"}
+
+# scrapers send "Authorization: Bearer <token>"; unset → localhost only
+METRICS_TOKEN = os.environ.get("BOOKAI_METRICS_TOKEN")
+
+_migration_stop = threading.Event()
+
+
+# =========================================================
+# 🔁 BACKGROUND RE-EMBEDDING (opt-in, one worker wins the lock)
+# =========================================================
+@app.on_event("startup")
+def start_migration():
+    if os.environ.get("BOOK_MIGRATE") == "1":
+        start_background(_migration_stop)
+
+
+@app.on_event("shutdown")
+def stop_migration():
+    _migration_stop.set()
+
+
+# =========================================================
+# ⏱ REQUEST TIMING
+# =========================================================
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    endpoint = request.url.path if request.url.path in TRACKED_ENDPOINTS else "other"
+    status = 500
+
+    INFLIGHT.inc(endpoint)
+    start = time.perf_counter()
+
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        INFLIGHT.dec(endpoint)
+        REQUEST_SECONDS.observe(endpoint, status, seconds=time.perf_counter() - start)
+
+
+# =========================================================
+# 🚦 SHED LOAD (429 queue full / 503 queue timeout or deadline)
+# =========================================================
+@app.exception_handler(Rejected)
+async def on_rejected(request: Request, exc: Rejected):
+    return JSONResponse(
+        status_code=exc.status,
+        content={"status": "busy", "reason": exc.reason},
+        headers={"Retry-After": "1"}
+    )
+
+
+@app.exception_handler(DeadlineExceeded)
+async def on_deadline(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=503, content={"status": "timeout"})
 
 
 # =========================================================
 # 🔐 AUTH HELPER (CRITICAL FIX)
+# call inside admit() → token checks are gated and bounded by
+# the request deadline, and never block the event loop
 # =========================================================
 async def get_uid(request: Request):
     auth_header = request.headers.get("Authorization")
@@ -36,7 +113,38 @@ async def get_uid(request: Request):
         return None
 
     token = auth_header.split(" ")[1]
-    return verify_user(token)
+
+    with span("auth"):
+        return await run(REMOTE_POOL, verify_user, token)
+
+
+# =========================================================
+# 📦 SHARD SCOPE
+# all     → public catalog + my private collection (+ my library)
+# mine    → only my private collection
+# global  → only the public catalog
+# library → only my library's collection (needs ?library=<id>)
+# =========================================================
+def shards_for(uid: str, scope: str, library: str = None):
+    if scope == "all":
+        shards = [GLOBAL_SHARD, user_shard(uid)]
+        if library:
+            shards.append(library_shard(library))
+        return shards
+    if scope == "mine":
+        return [user_shard(uid)]
+    if scope == "global":
+        return [GLOBAL_SHARD]
+    if scope == "library" and library:
+        return [library_shard(library)]
+    return None
+
+
+# no library requested → nothing to check
+async def library_allowed(uid: str, library: str):
+    if not library:
+        return True
+    return await run(REMOTE_POOL, user_in_library, uid, library)
 
 
 # =========================================================
@@ -47,12 +155,31 @@ def root():
     return {"status": "running"}
 
 
+# =========================================================
+# 📈 METRICS (Prometheus text format, internal only)
+# =========================================================
+def metrics_allowed(request: Request):
+    if METRICS_TOKEN:
+        auth_header = request.headers.get("Authorization", "")
+        return hmac.compare_digest(auth_header, f"Bearer {METRICS_TOKEN}")
+
+    return request.client is not None and request.client.host in ("127.0.0.1", "::1")
+
+
+@app.get("/metrics")
+def metrics(request: Request):
+    if not metrics_allowed(request):
+        return JSONResponse(status_code=403, content={"status": "forbidden"})
+
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
 # =========================================================
 # 🖼 IMAGE VALIDATION
 # =========================================================
 def validate_image(path: str):
     try:
-        with Image.open(path) as img:
+        with span("validate"), Image.open(path) as img:
             img.load()
         return True
     except:
@@ -72,7 +199,7 @@ def save_temp(file: UploadFile):
 
     path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}.jpg")
 
-    with open(path, "wb") as buffer:
+    with span("temp_save"), open(path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
 
     file.file.close()
@@ -83,92 +210,227 @@ def save_temp(file: UploadFile):
 # 🔍 FLOW-1 → SCAN BOOK
 # =========================================================
 @app.post("/scan")
-async def scan(request: Request, file: UploadFile = File(...)):
+async def scan(request: Request, file: UploadFile = File(...), scope: str = "all", library: str = None):
 
-    uid = await get_uid(request)
-    if not uid:
-        return JSONResponse(status_code=401, content={"status": "unauthorized"})
+    if library is not None and not LIBRARY_ID.match(library):
+        return JSONResponse(status_code=400, content={"status": "invalid_library"})
 
-    path = save_temp(file)
+    async with admit("scan"):
 
-    if not validate_image(path):
-        os.remove(path)
-        return JSONResponse(status_code=400, content={"status": "invalid_image"})
+        uid = await get_uid(request)
+        if not uid:
+            return JSONResponse(status_code=401, content={"status": "unauthorized"})
 
-    try:
-        book, score = await asyncio.to_thread(search_book, path)
+        shards = shards_for(uid, scope, library)
+        if shards is None:
+            return JSONResponse(status_code=400, content={"status": "invalid_scope"})
 
-        if book is None:
-            return {"status": "not_found"}
+        if not await library_allowed(uid, library):
+            return JSONResponse(status_code=403, content={"status": "forbidden"})
 
-        title = book["title"]
+        path = save_temp(file)
 
-        if user_has_book(uid, title):
-            return {"status": "owned", "title": title}
+        try:
+            if not await run(EMBED_POOL, validate_image, path):
+                return JSONResponse(status_code=400, content={"status": "invalid_image"})
 
-        return {
-            "status": "found",
-            "title": title,
-            "confidence": round(float(score), 3)
-        }
+            book, score = await run(EMBED_POOL, search_book, path, shards)
 
-    finally:
-        if os.path.exists(path):
-            os.remove(path)
+            if book is None:
+                return {"status": "not_found"}
+
+            title = book["title"]
+
+            if await run(REMOTE_POOL, user_has_book, uid, title):
+                return {"status": "owned", "title": title}
+
+            return {
+                "status": "found",
+                "title": title,
+                "confidence": round(float(score), 3)
+            }
+
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
 
 
 # =========================================================
 # 📷 ADD BOOK (LEARN)
 # =========================================================
 @app.post("/add")
-async def add(request: Request, file: UploadFile = File(...)):
+async def add(request: Request, file: UploadFile = File(...), collection: str = "global", library: str = None):
 
-    uid = await get_uid(request)
-    if not uid:
-        return JSONResponse(status_code=401, content={"status": "unauthorized"})
+    if library is not None and not LIBRARY_ID.match(library):
+        return JSONResponse(status_code=400, content={"status": "invalid_library"})
 
-    path = None
+    if collection not in ("global", "mine", "library") or (collection == "library" and not library):
+        return JSONResponse(status_code=400, content={"status": "invalid_collection"})
 
-    try:
-        path = save_temp(file)
-    except ValueError:
-        return JSONResponse(status_code=413, content={"status": "file_too_large"})
+    async with admit("add"):
 
-    if not validate_image(path):
-        if os.path.exists(path):
-            os.remove(path)
-        return JSONResponse(status_code=400, content={"status": "invalid_image"})
+        uid = await get_uid(request)
+        if not uid:
+            return JSONResponse(status_code=401, content={"status": "unauthorized"})
 
-    try:
-        # check already exists
-        book, score = await asyncio.to_thread(search_book, path)
+        if not await library_allowed(uid, library):
+            return JSONResponse(status_code=403, content={"status": "forbidden"})
 
-        # ---------- EXISTING ----------
-        if book is not None:
-            title = book["title"]
+        if collection == "global":
+            target = GLOBAL_SHARD
+        elif collection == "mine":
+            target = user_shard(uid)
+        else:
+            target = library_shard(library)
 
-            if user_has_book(uid, title):
-                return {"status": "already_saved", "title": title}
+        path = None
 
-            save_book_for_user(uid, title)
-            return {"status": "saved_existing", "title": title}
+        try:
+            path = save_temp(file)
+        except ValueError:
+            return JSONResponse(status_code=413, content={"status": "file_too_large"})
 
-        # ---------- NEW ----------
-        unique_title = f"Book_{uuid.uuid4().hex[:8]}"
+        try:
+            if not await run(EMBED_POOL, validate_image, path):
+                return JSONResponse(status_code=400, content={"status": "invalid_image"})
 
-        with index_lock:
-            await asyncio.to_thread(add_book, path, unique_title)
+            # check already exists (anywhere this user can see)
+            book, score = await run(EMBED_POOL, search_book, path, shards_for(uid, "all", library))
 
-        save_book_for_user(uid, unique_title)
+            # ---------- EXISTING ----------
+            if book is not None:
+                title = book["title"]
 
-        return {"status": "saved_new", "title": unique_title}
+                if await run(REMOTE_POOL, user_has_book, uid, title):
+                    return {"status": "already_saved", "title": title}
 
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+                await run(REMOTE_POOL, save_book_for_user, uid, title)
+                return {"status": "saved_existing", "title": title}
 
-    finally:
-        if path and os.path.exists(path):
-            os.remove(path)
+            # ---------- NEW ----------
+            unique_title = f"Book_{uuid.uuid4().hex[:8]}"
+
+            # shard.add serializes writers itself (thread + file lock);
+            # waiting on it must not hold an embedding thread
+            emb = await run(EMBED_POOL, embed_cover, path)
+            if emb is not None:
+                await run(WRITE_POOL, store_book, path, emb, unique_title, target)
+
+            await run(REMOTE_POOL, save_book_for_user, uid, unique_title)
+
+            return {"status": "saved_new", "title": unique_title}
+
+        except DeadlineExceeded:
+            raise
+
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+        finally:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+
+# =========================================================
+# 📚 SHELF SCAN (many covers, one ownership lookup)
+# =========================================================
+@app.post("/scan-shelf")
+async def scan_shelf(request: Request, files: List[UploadFile] = File(...), scope: str = "all", library: str = None):
+
+    if len(files) > MAX_SHELF_FILES:
+        return JSONResponse(status_code=413, content={"status": "too_many_files", "max": MAX_SHELF_FILES})
+
+    if library is not None and not LIBRARY_ID.match(library):
+        return JSONResponse(status_code=400, content={"status": "invalid_library"})
+
+    async with admit("scan-shelf"):
+
+        uid = await get_uid(request)
+        if not uid:
+            return JSONResponse(status_code=401, content={"status": "unauthorized"})
+
+        shards = shards_for(uid, scope, library)
+        if shards is None:
+            return JSONResponse(status_code=400, content={"status": "invalid_scope"})
+
+        if not await library_allowed(uid, library):
+            return JSONResponse(status_code=403, content={"status": "forbidden"})
+
+        results = []
+
+        for file in files:
+            check_deadline()
+
+            path = None
+
+            try:
+                path = save_temp(file)
+            except ValueError:
+                results.append({"status": "file_too_large"})
+                continue
+
+            try:
+                if not await run(EMBED_POOL, validate_image, path):
+                    results.append({"status": "invalid_image"})
+                    continue
+
+                book, score = await run(EMBED_POOL, search_book, path, shards)
+
+                if book is None:
+                    results.append({"status": "not_found"})
+                    continue
+
+                results.append({
+                    "status": "found",
+                    "title": book["title"],
+                    "confidence": round(float(score), 3)
+                })
+
+            finally:
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+        titles = [r["title"] for r in results if r["status"] == "found"]
+
+        if titles:
+            owned = await run(REMOTE_POOL, user_has_books, uid, titles)
+            for r in results:
+                if r["status"] == "found" and owned.get(r["title"]):
+                    r["status"] = "owned"
+                    del r["confidence"]
+
+        return {"status": "ok", "results": results}
+
+
+# =========================================================
+# 🔄 SYNC OFFLINE QUEUE
+# titles the app saved while offline → one batched read + write
+# =========================================================
+class SyncRequest(BaseModel):
+    titles: List[str]
+
+
+@app.post("/sync")
+async def sync_books(request: Request, body: SyncRequest):
+
+    if len(body.titles) > MAX_SYNC_TITLES:
+        return JSONResponse(status_code=413, content={"status": "too_many_titles", "max": MAX_SYNC_TITLES})
+
+    async with admit("sync"):
+
+        uid = await get_uid(request)
+        if not uid:
+            return JSONResponse(status_code=401, content={"status": "unauthorized"})
+
+        owned = await run(REMOTE_POOL, user_has_books, uid, body.titles)
+
+        already = [t for t in body.titles if owned.get(t)]
+        missing = [t for t in body.titles if not owned.get(t)]
+
+        if missing and not await run(REMOTE_POOL, save_books_for_user, uid, missing):
+            return JSONResponse(status_code=500, content={"status": "error"})
+
+        return {"status": "synced", "saved": missing, "already_saved": already}
 
 
 # =========================================================
@@ -177,37 +439,44 @@ async def add(request: Request, file: UploadFile = File(...)):
 @app.post("/ask-book-ai")
 async def ask_book_ai(file: UploadFile = File(...)):
 
-    path = f"{UPLOAD_DIR}/{uuid.uuid4().hex}.jpg"
+    async with admit("ask-book-ai"):
 
-    try:
-        contents = await file.read()
+        path = f"{UPLOAD_DIR}/{uuid.uuid4().hex}.jpg"
 
-        if not contents:
-            return JSONResponse(status_code=400, content={"error": "Empty image uploaded"})
+        try:
+            contents = await file.read()
 
-        with open(path, "wb") as f:
-            f.write(contents)
+            if not contents:
+                return JSONResponse(status_code=400, content={"error": "Empty image uploaded"})
 
-        book_name = await asyncio.to_thread(detect_book, path)
+            with span("temp_save"), open(path, "wb") as f:
+                f.write(contents)
 
-        if not book_name:
-            return JSONResponse(status_code=422, content={"error": "Could not identify book"})
+            book_name = await run(REMOTE_POOL, detect_book, path)
+            check_deadline()
 
-        book = get_book_info(book_name)
+            if not book_name:
+                return JSONResponse(status_code=422, content={"error": "Could not identify book"})
 
-        if not book:
-            return JSONResponse(status_code=404, content={"error": f"No info found for '{book_name}'"})
+            book = await run(REMOTE_POOL, get_book_info, book_name)
+            check_deadline()
 
-        overview = await asyncio.to_thread(summarize_book, book)
+            if not book:
+                return JSONResponse(status_code=404, content={"error": f"No info found for '{book_name}'"})
 
-        return {
-            "title": book["title"],
-            "overview": overview
-        }
+            overview = await run(REMOTE_POOL, summarize_book, book)
 
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+            return {
+                "title": book["title"],
+                "overview": overview
+            }
 
-    finally:
-        if os.path.exists(path):
-            os.remove(path)
\ No newline at end of file
+        except DeadlineExceeded:
+            raise
+
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"error": str(e)})
+
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,185 @@
+import time
+import bisect
+from threading import Lock
+from contextlib import contextmanager
+
+# =========================================================
+# 📈 METRICS
+# tiny in-process registry rendered in Prometheus text format
+# (per worker — scrape each worker, or run with --workers 1)
+# =========================================================
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _key(values):
+    return tuple(str(v) for v in values)
+
+
+# ---------------- COUNTER ----------------
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = Lock()
+        _registry.append(self)
+
+    def inc(self, *values, amount=1):
+        key = _key(values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, v in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {v}")
+        return lines
+
+
+# ---------------- GAUGE ----------------
+# fn → called at scrape time, returns {label_values_tuple: value}
+class Gauge:
+
+    def __init__(self, name, help, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.fn = fn
+        self._values = {}
+        self._lock = Lock()
+        _registry.append(self)
+
+    def set(self, *values, value):
+        with self._lock:
+            self._values[_key(values)] = value
+
+    def inc(self, *values, amount=1):
+        key = _key(values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *values, amount=1):
+        self.inc(*values, amount=-amount)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        if self.fn is not None:
+            values.update({_key(k): v for k, v in self.fn().items()})
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, v in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {v}")
+        return lines
+
+
+# ---------------- HISTOGRAM ----------------
+class Histogram:
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}   # key → [bucket counts..., sum, count]
+        self._lock = Lock()
+        _registry.append(self)
+
+    def observe(self, *values, seconds):
+        key = _key(values)
+        i = bisect.bisect_left(self.buckets, seconds)
+
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                row[i] += 1
+            row[-2] += seconds
+            row[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        with self._lock:
+            rows = sorted((k, list(v)) for k, v in self._values.items())
+
+        for key, row in rows:
+            cumulative = 0
+            for le, n in zip(self.buckets, row):
+                cumulative += n
+                labels = _labels(self.labels + ("le",), key + (str(le),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _labels(self.labels + ("le",), key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {row[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {row[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {row[-1]}")
+
+        return lines
+
+
+# =========================================================
+# 📏 SHARED METRICS
+# =========================================================
+STAGE_SECONDS = Histogram(
+    "bookai_stage_seconds",
+    "Time spent in each pipeline stage",
+    labels=("stage",)
+)
+
+REQUEST_SECONDS = Histogram(
+    "bookai_request_seconds",
+    "End-to-end request latency",
+    labels=("endpoint", "status")
+)
+
+INFLIGHT = Gauge(
+    "bookai_inflight_requests",
+    "Requests currently being handled",
+    labels=("endpoint",)
+)
+
+CACHE = Counter(
+    "bookai_cache_total",
+    "Cache lookups by result",
+    labels=("cache", "result")
+)
+
+MODEL_LOAD_SECONDS = Gauge(
+    "bookai_model_load_seconds",
+    "Time taken to load each vision model",
+    labels=("backbone",)
+)
+
+
+# ---------------- SPAN ----------------
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(stage, seconds=time.perf_counter() - start)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,193 @@
+import os
+import sys
+import fcntl
+import threading
+
+from image_embedder import get_image_embedding, EMBEDDERS, EMBEDDER_VERSION
+from image_search import (
+    DATA_DIR, get_space, list_shards, read_space, write_space,
+    shard_dir, shard_kind, normalize
+)
+from admission import GATES
+from metrics import Gauge
+
+# =========================================================
+# 🔁 RE-EMBEDDING MIGRATION
+# fills the EMBEDDER_VERSION space of every shard from the stored
+# covers, then flips space.json so that version becomes active.
+# until the flip both spaces are searched (see searchable_versions)
+#
+#   python migrate_embeddings.py              → run once in the foreground
+#   python migrate_embeddings.py retire v1    → stop searching v1 everywhere
+#   BOOK_MIGRATE=1 uvicorn main:app ...       → throttled background thread
+# =========================================================
+
+# pause between covers so live traffic keeps the CPU
+MIGRATE_INTERVAL = float(os.environ.get("BOOK_MIGRATE_INTERVAL", "0.5"))
+
+LOCK_FILE = os.path.join(DATA_DIR, "migrate.lock")
+
+_remaining = {}
+
+
+def _remaining_by_kind():
+    totals = {}
+    for name, n in list(_remaining.items()):
+        key = (shard_kind(name),)
+        totals[key] = totals.get(key, 0) + n
+    return totals
+
+
+REMAINING = Gauge(
+    "bookai_migration_remaining",
+    "Books still to be re-embedded, per shard kind",
+    labels=("kind",),
+    fn=_remaining_by_kind
+)
+
+
+# ---------------- THROTTLE ----------------
+def _busy():
+    return any(g.waiting or g.sem.locked() for g in GATES.values())
+
+
+def _throttle(stop):
+    stop.wait(MIGRATE_INTERVAL)
+
+    # back off completely while requests are queueing
+    while _busy() and not stop.is_set():
+        stop.wait(MIGRATE_INTERVAL)
+
+
+# ---------------- ONE SHARD ----------------
+def migrate_shard(name, target=EMBEDDER_VERSION, stop=None):
+    stop = stop or threading.Event()
+
+    state = read_space(name)
+    source_version = state["active"]
+
+    if source_version == target:
+        return {"shard": name, "status": "current"}
+
+    # space.json written by newer code → leave it to a worker that knows it
+    if source_version not in EMBEDDERS or target not in EMBEDDERS:
+        print(f"⚠️ '{name}': no embedder for {source_version} → {target}, skipping")
+        return {"shard": name, "status": "unknown_version"}
+
+    source = get_space(name, source_version)
+    dest = get_space(name, target)
+    migrated, skipped = 0, []
+
+    # repeat until no new books show up (workers on the old config may still add)
+    while True:
+        source.sync()
+        dest.sync()
+
+        done = {b["title"] for b in dest.books} | set(skipped)
+        todo = [b for b in source.books if b["title"] not in done]
+
+        if not todo:
+            break
+
+        print(f"🔁 Migrating '{name}' {source_version} → {target}: {len(todo)} books")
+
+        for i, book in enumerate(todo):
+            _remaining[name] = len(todo) - i
+
+            if stop.is_set():
+                return {"shard": name, "status": "stopped", "left": len(todo) - i}
+
+            image = book.get("image")
+            path = os.path.join(shard_dir(name), image) if image else None
+
+            if not path or not os.path.exists(path):
+                skipped.append(book["title"])
+                continue
+
+            _throttle(stop)
+
+            emb = get_image_embedding(path, target)
+            if emb is None:
+                skipped.append(book["title"])
+                continue
+
+            # different books may look alike in the new space → keep them all
+            dest.add(normalize(emb), book["title"], image=image, dedupe=False)
+            migrated += 1
+
+    _remaining.pop(name, None)
+
+    # atomic flip; books we couldn't re-embed stay searchable in the old space
+    legacy = [v for v in state.get("legacy", []) if v != target]
+    if skipped:
+        legacy.append(source_version)
+    write_space(name, target, legacy)
+
+    print(f"✅ '{name}' now on {target} ({len(skipped)} books left in {source_version})")
+    return {"shard": name, "status": "migrated", "migrated": migrated, "skipped": len(skipped)}
+
+
+# ---------------- ALL SHARDS ----------------
+# only one process per DATA_DIR migrates; others return immediately
+def migrate_all(target=EMBEDDER_VERSION, stop=None):
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    with open(LOCK_FILE, "a+") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("🔁 Migration already running in another worker")
+            return []
+
+        try:
+            return [migrate_shard(name, target, stop) for name in list_shards()]
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# ---------------- RETIRE ----------------
+# ends the dual-index period: drops a version from every shard's legacy
+# list, so books left only in that space (no stored cover) stop matching.
+# files stay on disk → add the version back to space.json to undo
+def retire_version(version):
+    results = []
+
+    for name in list_shards():
+        state = read_space(name)
+
+        if state["active"] == version:
+            results.append({"shard": name, "status": "active"})
+            continue
+
+        if version not in state.get("legacy", []):
+            continue
+
+        legacy = [v for v in state["legacy"] if v != version]
+        write_space(name, state["active"], legacy)
+
+        print(f"🗑 '{name}' no longer searches {version}")
+        results.append({"shard": name, "status": "retired"})
+
+    return results
+
+
+def start_background(stop):
+    def _run():
+        try:
+            migrate_all(stop=stop)
+        except Exception as e:
+            print("🔥 Migration error:", e)
+
+    thread = threading.Thread(target=_run, name="migrate-embeddings", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "retire":
+        results = retire_version(sys.argv[2])
+    else:
+        results = migrate_all(sys.argv[1] if len(sys.argv) > 1 else EMBEDDER_VERSION)
+
+    for result in results:
+        print(result)
@@ -2,6 +2,8 @@ import requests
 import os
 from dotenv import load_dotenv
 from .prompts import SYSTEM_PROMPT
+from metrics import span
+from admission import remote_timeout
 
 load_dotenv()
 API_KEY = os.getenv("GROQ_API_KEY")
@@ -37,7 +39,8 @@ Explain this book in a simple short overview for students.
     }
 
     try:
-        res = requests.post(url, headers=headers, json=payload)
+        with span("groq_summary"):
+            res = requests.post(url, headers=headers, json=payload, timeout=remote_timeout(30))
         data = res.json()
 
         print("SUMMARY RESPONSE:", data)  # debug log
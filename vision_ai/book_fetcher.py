@@ -1,5 +1,7 @@
 import requests
 import re
+from metrics import span
+from admission import remote_timeout
 
 # -------------------------------------------------
 # Clean title  (remove extra symbols from LLM)
@@ -32,7 +34,8 @@ def fetch_openlibrary(title, author=None):
 
         print("OPENLIB QUERY:", url)
 
-        r = requests.get(url, timeout=10).json()
+        with span("openlibrary"):
+            r = requests.get(url, timeout=remote_timeout(10)).json()
 
         if "docs" not in r or len(r["docs"]) == 0:
             return None
@@ -67,7 +70,8 @@ def fetch_wikipedia(title):
         url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{title}"
         print("WIKI QUERY:", url)
 
-        r = requests.get(url, timeout=10)
+        with span("wikipedia"):
+            r = requests.get(url, timeout=remote_timeout(10))
 
         if r.status_code != 200:
             return None
@@ -3,6 +3,8 @@ import base64
 import os
 import re
 from dotenv import load_dotenv
+from metrics import span
+from admission import remote_timeout
 
 load_dotenv()
 API_KEY = os.getenv("GROQ_API_KEY")
@@ -72,7 +74,8 @@ def detect_book(image_path):
         }
 
         # request
-        res = requests.post(url, headers=headers, json=payload, timeout=60)
+        with span("groq_vision"):
+            res = requests.post(url, headers=headers, json=payload, timeout=remote_timeout(60))
 
         print("GROQ RAW:", res.text)
 